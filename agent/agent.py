@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 from pydantic import BaseModel
 from pydantic_ai import Agent, RunContext
 
-from agent.tools import execute_shell, search_web
+from agent.tools import execute_shell_async, search_web
 
 # Note: .env loading is handled in cli.py before imports
 # Verify environment variables are loaded
@@ -47,9 +47,10 @@ def search_web_tool(query: str) -> str:
     return search_web(query)
 
 @main_agent.tool_plain
-def execute_shell_tool(command: str) -> str:
+async def execute_shell_tool(command: str) -> str:
     """Execute a shell command safely."""
-    return execute_shell(command)
+    # Async so parallel tool calls run their commands concurrently
+    return await execute_shell_async(command)
 
 # Session management
 class ConversationSession:
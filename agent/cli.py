@@ -1,94 +1,157 @@
 import sys
 import os
+import io
+import time
 import shutil
 import argparse
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
 # Add the parent directory to the path so we can import agent modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Load .env BEFORE importing any agent modules
-from dotenv import load_dotenv
-import importlib.util
-
-# Try to load .env from site-packages directory first
-try:
-    spec = importlib.util.find_spec("agent")
-    if spec and spec.origin:
-        package_dir = Path(spec.origin).parent.parent
-        package_env = package_dir / ".env"
-        if package_env.exists():
-            load_dotenv(package_env)
-        else:
-            # Fallback to current directory
-            load_dotenv()
-    else:
-        load_dotenv()
-except:
-    load_dotenv()
+@lru_cache(maxsize=1)
+def _resolve_env_paths():
+    """Locate existing .env files once, in the order they should be tried.
 
-def setup_env_file(force_recreate=False):
-    """Load .env from current directory or package installation."""
-    from dotenv import load_dotenv
+    The current working directory takes precedence over the package
+    installation directory.
+    """
+    candidates = []
     
     # Strategy 1: Look for .env in current working directory (most common)
-    current_dir = Path.cwd()
-    env_file = current_dir / ".env"
-    
+    env_file = Path.cwd() / ".env"
     if env_file.exists():
-        print(f"📁 Using .env from current directory: {env_file}")
-        load_dotenv(env_file)
-        
-        # Verify keys are loaded
-        openai_key = os.getenv("OPENAI_API_KEY")
-        tavily_key = os.getenv("TAVILY_API_KEY")
-        if openai_key and tavily_key:
-            return True
-        else:
-            print(f"⚠️  .env file found but missing API keys")
+        candidates.append(("📁 Using .env from current directory", env_file))
     
     # Strategy 2: Look for .env in package installation directory
-    try:
-        import agent
-        package_dir = Path(agent.__file__).parent.parent
-        package_env = package_dir / ".env"
-        
-        if package_env.exists():
-            print(f"📦 Using .env from package installation: {package_env}")
-            load_dotenv(package_env)
-            
-            # Verify keys are loaded
-            openai_key = os.getenv("OPENAI_API_KEY")
-            tavily_key = os.getenv("TAVILY_API_KEY")
-            if openai_key and tavily_key:
-                return True
-    except Exception as e:
-        pass
+    package_env = Path(__file__).resolve().parent.parent / ".env"
+    if package_env.exists() and package_env != env_file.resolve():
+        candidates.append(("📦 Using .env from package installation", package_env))
     
-    # Strategy 3: Create template .env in current directory
-    if force_recreate or not env_file.exists():
-        template = """# Instant Agent Configuration
+    return tuple(candidates)
+
+def _write_env_template(env_file: Path):
+    """Write a template .env with placeholder API keys."""
+    template = """# Instant Agent Configuration
 OPENAI_API_KEY=your_openai_api_key_here
 TAVILY_API_KEY=your_tavily_api_key_here
 """
-        env_file.write_text(template)
-        print(f"📝 Created .env template at: {env_file}")
+    env_file.write_text(template)
+    print(f"📝 Created .env template at: {env_file}")
+
+def setup_env_file(force_recreate=False):
+    """Load .env from current directory or package installation.
+
+    With force_recreate, the current directory's .env is copied to .env.bak
+    and replaced by the template before anything is loaded.
+    """
+    from dotenv import load_dotenv
+    
+    env_file = Path.cwd() / ".env"
+    if force_recreate:
+        if env_file.exists():
+            backup = env_file.with_name(".env.bak")
+            shutil.copy2(env_file, backup)
+            print(f"💾 Backed up existing .env to: {backup}")
+        _write_env_template(env_file)
+    else:
+        for message, candidate in _resolve_env_paths():
+            print(f"{message}: {candidate}")
+            load_dotenv(candidate, override=False)
+            
+            # Verify keys are loaded
+            if os.getenv("OPENAI_API_KEY") and os.getenv("TAVILY_API_KEY"):
+                return True
+            print(f"⚠️  .env file found but missing API keys")
+        
+        # Strategy 3: Create template .env in current directory
+        if not env_file.exists():
+            _write_env_template(env_file)
+        print("❌ No valid .env file found!")
     
-    print("❌ No valid .env file found!")
     print("📝 Please edit the .env file with your actual API keys:")
     print("   OPENAI_API_KEY=your_actual_key")
     print("   TAVILY_API_KEY=your_actual_key")
     print(f"📍 Location: {env_file.absolute()}")
     return False
 
-from agent.agent import process_request, clear_conversation, get_conversation_summary
+class PrintBuffer:
+    """Coalesce small writes to stdout, flushing at most every `interval` seconds.
+
+    The window opens at the first buffered write, so time spent before any
+    output (e.g. waiting on the agent) does not force an immediate flush.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self._buffer = io.StringIO()
+        self._window_start: Optional[float] = None
+
+    def write(self, text: str):
+        """Buffer text, flushing once the current window is older than the interval."""
+        self._buffer.write(text)
+        now = time.monotonic()
+        if self._window_start is None:
+            self._window_start = now
+        elif now - self._window_start > self.interval:
+            self.flush()
+
+    def print(self, *values, sep: str = " ", end: str = "\n"):
+        """Buffered equivalent of the builtin print."""
+        self.write(sep.join(str(v) for v in values) + end)
+
+    def flush(self):
+        """Write buffered text to stdout."""
+        text = self._buffer.getvalue()
+        if text:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            self._buffer = io.StringIO()
+        self._window_start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+def _quit() -> bool:
+    print("Goodbye!")
+    return False
+
+def _clear() -> bool:
+    from agent.agent import clear_conversation
+    clear_conversation()
+    print("Conversation history cleared.")
+    return True
+
+def _history() -> bool:
+    from agent.agent import get_conversation_summary
+    print(f"{get_conversation_summary()}")
+    return True
+
+# Special chat commands; a handler returns False to end the session
+COMMANDS = {
+    'quit': _quit,
+    'exit': _quit,
+    'q': _quit,
+    'clear': _clear,
+    'history': _history,
+}
 
 def chat():
     """Basic chat interface for the agent."""
-    print("Instant Agents CLI - Type 'quit' to exit")
-    print("I can search the web and execute shell commands safely.")
-    print("Commands: 'clear' to reset conversation, 'history' to see message count")
-    print("-" * 60)
+    # Imported here so setup_env_file has loaded .env before the agent is built
+    from agent.agent import process_request
+    
+    with PrintBuffer() as out:
+        out.print("Instant Agents CLI - Type 'quit' to exit")
+        out.print("I can search the web and execute shell commands safely.")
+        out.print("Commands: 'clear' to reset conversation, 'history' to see message count")
+        out.print("-" * 60)
     
     while True:
         try:
@@ -97,40 +160,46 @@ def chat():
             print("\nGoodbye!")
             break
         
-        if user_input.lower() in ['quit', 'exit', 'q']:
-            print("Goodbye!")
-            break
-        
         # Special commands
-        if user_input.lower() == 'clear':
-            clear_conversation()
-            print("Conversation history cleared.")
-            continue
-        
-        if user_input.lower() == 'history':
-            print(f"{get_conversation_summary()}")
+        handler = COMMANDS.get(user_input.lower())
+        if handler:
+            if not handler():
+                break
             continue
             
         if not user_input:
             continue
             
-        try:
-            response = process_request(user_input)
-            print(f"Agent: {response}")
-                
-        except Exception as e:
-            print(f"Error: {str(e)}")
-        
-        print("-" * 60)  # Add divider between interactions
+        # Flush once the turn's output is complete, before prompting again
+        with PrintBuffer() as out:
+            try:
+                response = process_request(user_input)
+                out.print(f"Agent: {response}")
+                    
+            except Exception as e:
+                out.print(f"Error: {str(e)}")
+            
+            out.print("-" * 60)  # Add divider between interactions
 
 def main():
     parser = argparse.ArgumentParser(description='Instant Agents CLI')
     parser.add_argument('--reset-env', action='store_true', 
-                       help='Force recreate .env file with template')
+                       help='Force recreate .env file with template and exit')
+    parser.add_argument('--dump-memory', action='store_true',
+                       help='Pretty-print the persistent execution memory and exit')
     args = parser.parse_args()
     
+    if args.dump_memory:
+        from agent.execution_engine import execution_memory
+        print(execution_memory.dump())
+        return
+    
+    if args.reset_env:
+        setup_env_file(force_recreate=True)
+        return
+    
     # Check for .env file and setup if needed
-    if not setup_env_file(force_recreate=args.reset_env):
+    if not setup_env_file():
         sys.exit(1)
     
     chat()
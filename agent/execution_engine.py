@@ -1,16 +1,79 @@
+import asyncio
+import atexit
 import json
 import os
-from dataclasses import asdict, dataclass
+import sys
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from pydantic import BaseModel
-from pydantic_ai import Agent
+from agent.tools import format_shell_output, run_shell_async, search_web
 
-from agent.tools import execute_shell, search_web
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-@dataclass
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def _empty_memory() -> Dict:
+    """Default persistent memory schema."""
+    return {
+        "successful_patterns": [],
+        "failed_patterns": [],
+        "learned_commands": {},
+        "task_history": []
+    }
+
+
+def _coalesce_patterns(
+    patterns: List[Dict], count_field: str, limit: int, required: Tuple[str, ...]
+) -> "OrderedDict[Tuple[str, str], Dict]":
+    """Merge patterns sharing (action_type, command), summing their counts.
+
+    Entries that are not objects or lack any of the `required` fields are
+    skipped with a warning. Returns the last `limit` patterns keyed by
+    (action_type, command), oldest first.
+    """
+    merged: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+    skipped = 0
+    for pattern in patterns:
+        if not isinstance(pattern, dict) or any(f not in pattern for f in required):
+            skipped += 1
+            continue
+        key = (pattern["action_type"], pattern["command"])
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = pattern
+        else:
+            existing[count_field] = existing.get(count_field, 1) + pattern.get(count_field, 1)
+            merged.move_to_end(key)
+    if skipped:
+        print(f"Warning: Skipped {skipped} malformed memory pattern(s)")
+    while len(merged) > limit:
+        merged.popitem(last=False)
+    return merged
+
+
+# dataclass(slots=True) is only available from Python 3.10
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
 class ExecutionStep:
     step_number: int
     description: str
@@ -21,47 +84,305 @@ class ExecutionStep:
     timestamp: str = ""
     retry_count: int = 0
 
-@dataclass
+@dataclass(**_SLOTS)
 class TaskExecution:
     task_id: str
     original_query: str
     research_phase: Optional[str] = None
-    plan: List[Dict] = None
-    steps: List[ExecutionStep] = None
+    plan: List[Dict] = field(default_factory=list)
+    steps: List[ExecutionStep] = field(default_factory=list)
     current_step: int = 0
     status: str = "planning"  # planning, executing, completed, failed
     final_result: Optional[str] = None
     created_at: str = ""
 
 class ExecutionMemory:
+    # Only the most recent entries are kept in memory and on disk
+    MAX_TASK_HISTORY = 1000
+    MAX_PATTERNS = 500
+
     def __init__(self, memory_file: str = "agent/execution_memory.json"):
         self.memory_file = memory_file
+        self.log_file = os.path.splitext(memory_file)[0] + ".log.jsonl"
+        self.lock_file = memory_file + ".lock"
         self.current_execution: Optional[TaskExecution] = None
-        self.persistent_memory = self._load_persistent_memory()
+        # Rendered get_execution_context() output, reset whenever the task changes
+        self._ctx_cache: Optional[str] = None
+        self._log = None
+        self._lock_handle = None
+        self._dir_ready = False
+        self._dirty = False
+        # Log records are tagged "<writer>:<n>" so each one is unique across
+        # processes sharing the same memory file
+        self._writer = uuid.uuid4().hex[:12]
+        self._record_count = 0
+        with self._locked(exclusive=False, create=False):
+            self._load_state()
+        atexit.register(self._flush)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._flush()
+        return False
     
+    @contextmanager
+    def _locked(self, exclusive: bool, create: bool = True):
+        """Hold the inter-process memory lock.
+
+        Appends take it shared and compaction exclusive, so no record can be
+        written between a compaction reading the log and truncating it.
+        With create=False the lock is skipped if its file does not exist
+        yet, so loading memory never creates files.
+        """
+        if fcntl is None:
+            yield
+            return
+        if self._lock_handle is None:
+            if not create and not os.path.exists(self.lock_file):
+                yield
+                return
+            self._ensure_dir()
+            self._lock_handle = open(self.lock_file, 'a')
+        fcntl.flock(self._lock_handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+
+    def _load_state(self) -> List[str]:
+        """Load the snapshot, replay the log on top and rebuild the indexes.
+
+        Returns the ids of every record currently in the log.
+        """
+        self.persistent_memory = self._load_persistent_memory()
+        self._bound_memory()
+        self._build_indexes()
+        return self._replay_log()
+
     def _load_persistent_memory(self) -> Dict:
         """Load persistent memory from file."""
+        memory = {}
         if os.path.exists(self.memory_file):
             try:
-                with open(self.memory_file, 'r') as f:
-                    return json.load(f)
-            except:
-                pass
-        return {
-            "successful_patterns": [],
-            "failed_patterns": [],
-            "learned_commands": {},
-            "task_history": []
-        }
+                with open(self.memory_file, 'rb') as f:
+                    memory = json.load(f)
+                if not isinstance(memory, dict):
+                    raise ValueError("memory file does not contain a JSON object")
+            except Exception as e:
+                print(f"Warning: Could not load memory ({type(e).__name__}): {e}")
+                memory = {}
+        # Fill in anything missing or mistyped in older or partial snapshots
+        for key, default in _empty_memory().items():
+            if not isinstance(memory.setdefault(key, default), type(default)):
+                print(f"Warning: Ignoring malformed memory field '{key}'")
+                memory[key] = default
+        return memory
+
+    def _bound_memory(self):
+        """Merge duplicate patterns and keep only the most recent entries.
+
+        Patterns are held in OrderedDicts keyed by (action_type, command),
+        least recently used first, so hits can move to the end and the
+        least recently used pattern is the one evicted.
+        """
+        memory = self.persistent_memory
+        memory["successful_patterns"] = _coalesce_patterns(
+            memory["successful_patterns"], "success_count", self.MAX_PATTERNS,
+            ("action_type", "command", "description_keywords")
+        )
+        memory["failed_patterns"] = _coalesce_patterns(
+            memory["failed_patterns"], "failure_count", self.MAX_PATTERNS,
+            ("action_type", "command")
+        )
+        memory["task_history"] = deque(memory["task_history"], maxlen=self.MAX_TASK_HISTORY)
+
+    def _build_indexes(self):
+        """Index loaded patterns by keyword and by action_type."""
+        # action_type -> keyword -> successful patterns containing that keyword
+        self._kw_index: Dict[str, Dict[str, Dict[Tuple[str, str], Dict]]] = defaultdict(lambda: defaultdict(dict))
+        self._fail_by_type: Dict[str, Dict[Tuple[str, str], Dict]] = defaultdict(dict)
+        for key, pattern in self.persistent_memory["successful_patterns"].items():
+            self._index_keywords(key, pattern)
+        for key, pattern in self.persistent_memory["failed_patterns"].items():
+            self._fail_by_type[pattern["action_type"]][key] = pattern
+
+    def _index_keywords(self, key: Tuple[str, str], pattern: Dict):
+        """Add a successful pattern to the keyword index of its action type."""
+        by_keyword = self._kw_index[pattern["action_type"]]
+        for keyword in set(pattern["description_keywords"]):
+            by_keyword[keyword][key] = pattern
+
+    def _unindex_successful(self, key: Tuple[str, str], pattern: Dict):
+        """Drop an evicted successful pattern from the keyword index."""
+        by_keyword = self._kw_index[pattern["action_type"]]
+        for keyword in set(pattern["description_keywords"]):
+            by_keyword[keyword].pop(key, None)
+
+    def _replay_log(self) -> List[str]:
+        """Apply changes logged since the last snapshot was written.
+
+        Records listed in the snapshot's "compacted_ids" are skipped: they
+        are left over from a compaction that stopped before emptying the log.
+        Returns the ids of every record in the log.
+        """
+        log_ids = []
+        if not os.path.exists(self.log_file):
+            return log_ids
+        compacted = set(self.persistent_memory.get("compacted_ids", ()))
+        try:
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Skip a partially written trailing line
+                        continue
+                    if not isinstance(record, dict):
+                        continue
+                    record_id = record.get("id")
+                    if record_id is not None:
+                        log_ids.append(record_id)
+                        if record_id in compacted:
+                            continue
+                    try:
+                        self._apply_record(record)
+                    except (KeyError, TypeError) as e:
+                        print(f"Warning: Skipped malformed memory log record ({type(e).__name__}): {e}")
+        except Exception as e:
+            print(f"Warning: Could not replay memory log: {e}")
+        return log_ids
     
-    def _save_persistent_memory(self):
+    def _save_persistent_memory(self) -> bool:
         """Save persistent memory to file."""
         try:
-            os.makedirs(os.path.dirname(self.memory_file), exist_ok=True)
-            with open(self.memory_file, 'w') as f:
-                json.dump(self.persistent_memory, f, indent=2)
+            self._ensure_dir()
+            tmp_file = self.memory_file + ".tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(_dumps(self._snapshot()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.memory_file)
+            return True
         except Exception as e:
             print(f"Warning: Could not save memory: {e}")
+            return False
+
+    def _ensure_dir(self):
+        """Create the memory directory the first time something is written."""
+        if not self._dir_ready:
+            os.makedirs(os.path.dirname(self.memory_file) or ".", exist_ok=True)
+            self._dir_ready = True
+
+    def _snapshot(self) -> Dict:
+        """Persistent memory as plain JSON-serializable containers."""
+        snapshot = {}
+        for key, value in self.persistent_memory.items():
+            if isinstance(value, OrderedDict):
+                value = list(value.values())
+            elif isinstance(value, deque):
+                value = list(value)
+            snapshot[key] = value
+        return snapshot
+
+    def dump(self) -> str:
+        """Pretty-printed persistent memory, for reading by humans."""
+        return json.dumps(self._snapshot(), indent=2)
+
+    def _append_log(self, record: Dict):
+        """Append a single change record to the memory log."""
+        try:
+            if self._log is None:
+                self._ensure_dir()
+                # Unbuffered so each record reaches the file in a single write
+                self._log = open(self.log_file, 'ab', buffering=0)
+            with self._locked(exclusive=False):
+                self._log.write(_dumps(record) + b"\n")
+        except Exception as e:
+            print(f"Warning: Could not log memory update: {e}")
+
+    def _truncate_log(self):
+        """Empty the memory log once its changes are in the snapshot.
+
+        The file is truncated in place rather than removed, so any process
+        still holding it open for append keeps writing to the live log.
+        Called with the exclusive lock held.
+        """
+        try:
+            os.truncate(self.log_file, 0)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Could not truncate memory log: {e}")
+
+    def _record(self, record: Dict):
+        """Apply a change in memory and append it to the log."""
+        self._record_count += 1
+        record["id"] = f"{self._writer}:{self._record_count}"
+        self._apply_record(record)
+        self._append_log(record)
+        self._dirty = True
+
+    def _flush(self):
+        """Compact logged changes into the snapshot file, if this process made any.
+
+        The state is rebuilt from disk under the exclusive lock first, so
+        changes other processes logged or compacted since this one loaded
+        are kept rather than overwritten. Every change this process made is
+        already in the log or in a snapshot another process compacted.
+        """
+        if not self._dirty:
+            return
+        with self._locked(exclusive=True):
+            log_ids = self._load_state()
+            self.persistent_memory["compacted_ids"] = log_ids
+            if self._save_persistent_memory():
+                self._truncate_log()
+                self._dirty = False
+
+    def _apply_record(self, record: Dict):
+        """Apply a logged change to the in-memory state."""
+        op = record.get("op")
+        if op == "succ":
+            key = (record["action_type"], record["command"])
+            patterns = self.persistent_memory["successful_patterns"]
+            existing = patterns.get(key)
+            if existing is not None:
+                existing["success_count"] += 1
+                patterns.move_to_end(key)
+                return
+            if len(patterns) >= self.MAX_PATTERNS:
+                self._unindex_successful(*patterns.popitem(last=False))
+            pattern = {
+                "action_type": record["action_type"],
+                "description_keywords": record["description_keywords"],
+                "command": record["command"],
+                "success_count": 1
+            }
+            patterns[key] = pattern
+            self._index_keywords(key, pattern)
+        elif op == "fail":
+            key = (record["action_type"], record["command"])
+            patterns = self.persistent_memory["failed_patterns"]
+            existing = patterns.get(key)
+            if existing is not None:
+                existing["failure_count"] += 1
+                patterns.move_to_end(key)
+                return
+            if len(patterns) >= self.MAX_PATTERNS:
+                evicted_key, evicted = patterns.popitem(last=False)
+                del self._fail_by_type[evicted["action_type"]][evicted_key]
+            pattern = {
+                "action_type": record["action_type"],
+                "command": record["command"],
+                "error_context": record["error_context"],
+                "failure_count": 1
+            }
+            patterns[key] = pattern
+            self._fail_by_type[pattern["action_type"]][key] = pattern
+        elif op == "task":
+            self.persistent_memory["task_history"].append(record["task"])
     
     def start_task(self, query: str) -> str:
         """Start a new task execution."""
@@ -69,27 +390,30 @@ class ExecutionMemory:
         self.current_execution = TaskExecution(
             task_id=task_id,
             original_query=query,
-            steps=[],
             created_at=datetime.now().isoformat()
         )
+        self._ctx_cache = None
         return task_id
     
     def add_research(self, research_result: str):
         """Add research phase result."""
         if self.current_execution:
             self.current_execution.research_phase = research_result
+            self._ctx_cache = None
     
     def set_plan(self, plan: List[Dict]):
         """Set the execution plan."""
         if self.current_execution:
             self.current_execution.plan = plan
             self.current_execution.status = "executing"
+            self._ctx_cache = None
     
     def add_step_result(self, step: ExecutionStep):
         """Add a completed step result."""
         if self.current_execution:
             step.timestamp = datetime.now().isoformat()
             self.current_execution.steps.append(step)
+            self._ctx_cache = None
             
             # Learn from success/failure
             if step.success:
@@ -97,43 +421,90 @@ class ExecutionMemory:
             else:
                 self._learn_failed_pattern(step)
     
+    async def execute_plan(self) -> List[ExecutionStep]:
+        """Run the current plan, executing steps whose dependencies are met concurrently.
+
+        Plan entries may list the step numbers they need in "depends_on";
+        entries without it depend on the step before them, so a plain
+        ordered plan runs sequentially. Use "depends_on": [] to opt a step
+        into running in parallel.
+        """
+        if not self.current_execution or not self.current_execution.plan:
+            return []
+        
+        pending = {}
+        depends_on = {}
+        previous = None
+        for i, spec in enumerate(self.current_execution.plan):
+            number = spec.get("step_number", i + 1)
+            pending[number] = spec
+            if "depends_on" in spec:
+                depends_on[number] = spec["depends_on"] or ()
+            else:
+                depends_on[number] = () if previous is None else (previous,)
+            previous = number
+        done = set()
+        executed = []
+        while pending:
+            ready = [
+                number for number in pending
+                if all(dep in done or dep not in pending for dep in depends_on[number])
+            ]
+            if not ready:
+                # Circular dependencies - fall back to plan order
+                ready = [next(iter(pending))]
+            
+            steps = await asyncio.gather(*(self._run_plan_step(n, pending[n]) for n in ready))
+            for number, step in zip(ready, steps):
+                del pending[number]
+                done.add(number)
+                if step is not None:
+                    self.add_step_result(step)
+                    executed.append(step)
+        return executed
+    
+    async def _run_plan_step(self, number: int, spec: Dict) -> Optional[ExecutionStep]:
+        """Execute a single plan step; steps without a runnable command return None."""
+        step = ExecutionStep(
+            step_number=number,
+            description=spec.get("description", ""),
+            action_type=spec.get("action_type", "analysis"),
+            command=spec.get("command")
+        )
+        if not step.command:
+            return None
+        if step.action_type == "shell":
+            try:
+                stdout, stderr, returncode = await run_shell_async(step.command)
+            except Exception as e:
+                step.result = str(e)
+                return step
+            step.result = format_shell_output(stdout, stderr, returncode)
+            step.success = returncode == 0
+        elif step.action_type == "search":
+            step.result = await asyncio.to_thread(search_web, step.command)
+            step.success = not step.result.startswith("Search error")
+        else:
+            return None
+        return step
+    
     def _learn_successful_pattern(self, step: ExecutionStep):
         """Learn from successful execution patterns."""
-        pattern = {
+        self._record({
+            "op": "succ",
             "action_type": step.action_type,
-            "description_keywords": step.description.lower().split()[:5],
-            "command": step.command,
-            "success_count": 1
-        }
-        
-        # Check if similar pattern exists
-        for existing in self.persistent_memory["successful_patterns"]:
-            if (existing["action_type"] == pattern["action_type"] and 
-                existing["command"] == pattern["command"]):
-                existing["success_count"] += 1
-                return
-        
-        self.persistent_memory["successful_patterns"].append(pattern)
-        self._save_persistent_memory()
+            "description_keywords": list(dict.fromkeys(step.description.lower().split()[:5])),
+            "command": step.command
+        })
     
     def _learn_failed_pattern(self, step: ExecutionStep):
         """Learn from failed execution patterns."""
-        pattern = {
+        self._record({
+            "op": "fail",
             "action_type": step.action_type,
             "command": step.command,
-            "error_context": step.result[:200] if step.result else "",
-            "failure_count": 1
-        }
-        
-        # Check if similar pattern exists
-        for existing in self.persistent_memory["failed_patterns"]:
-            if (existing["action_type"] == pattern["action_type"] and 
-                existing["command"] == pattern["command"]):
-                existing["failure_count"] += 1
-                return
-        
-        self.persistent_memory["failed_patterns"].append(pattern)
-        self._save_persistent_memory()
+            "error_context": step.result[:200] if step.result else ""
+        })
     
     def get_relevant_memory(self, action_type: str, description: str) -> Dict:
         """Get relevant memory for current action."""
@@ -143,18 +514,19 @@ class ExecutionMemory:
             "suggestions": []
         }
         
-        keywords = description.lower().split()
+        # Ordered de-duplication keeps the result stable across runs
+        keywords = dict.fromkeys(description.lower().split())
         
         # Find relevant successful patterns
-        for pattern in self.persistent_memory["successful_patterns"]:
-            if pattern["action_type"] == action_type:
-                if any(kw in pattern["description_keywords"] for kw in keywords):
-                    relevant["successful_commands"].append(pattern["command"])
+        by_keyword = self._kw_index.get(action_type, {})
+        matched = {}
+        for kw in keywords:
+            matched.update(by_keyword.get(kw, {}))
+        relevant["successful_commands"].extend(p["command"] for p in matched.values())
         
         # Find relevant failed patterns to avoid
-        for pattern in self.persistent_memory["failed_patterns"]:
-            if pattern["action_type"] == action_type:
-                relevant["failed_commands"].append(pattern["command"])
+        for pattern in self._fail_by_type.get(action_type, {}).values():
+            relevant["failed_commands"].append(pattern["command"])
         
         return relevant
     
@@ -163,6 +535,7 @@ class ExecutionMemory:
         if self.current_execution:
             self.current_execution.final_result = final_result
             self.current_execution.status = "completed" if success else "failed"
+            self._ctx_cache = None
             
             # Save to persistent history
             task_summary = {
@@ -173,13 +546,15 @@ class ExecutionMemory:
                 "completed_at": datetime.now().isoformat()
             }
             
-            self.persistent_memory["task_history"].append(task_summary)
-            self._save_persistent_memory()
+            self._record({"op": "task", "task": task_summary})
+            self._flush()
     
     def get_execution_context(self) -> str:
         """Get current execution context as string for LLM."""
         if not self.current_execution:
             return "No current task execution."
+        if self._ctx_cache is not None:
+            return self._ctx_cache
         
         context = [
             f"Current Task: {self.current_execution.original_query}",
@@ -195,7 +570,8 @@ class ExecutionMemory:
                 status = "✅" if step.success else "❌"
                 context.append(f"  {status} {step.description}")
         
-        return "\n".join(context)
+        self._ctx_cache = "\n".join(context)
+        return self._ctx_cache
 
 # Global memory instance
 execution_memory = ExecutionMemory()
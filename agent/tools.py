@@ -1,45 +1,192 @@
+import asyncio
+import atexit
 import os
+import re
+import selectors
+import shlex
+import shutil
+import signal
 import subprocess
-from typing import Any, Dict
+import tempfile
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 
-from dotenv import load_dotenv
-from tavily import TavilyClient
+# Basic safety check - commands matching this are refused by execute_shell
+_DANGEROUS_RE = re.compile(r"\b(?:rm\s+-rf|sudo|chmod\s+777|dd\s+if=|mkfs|fdisk)", re.IGNORECASE)
 
 # Note: .env loading is handled in cli.py before imports
 
 # Initialize Tavily client lazily to ensure .env is loaded first
-_tavily_client = None
-
+@lru_cache(maxsize=1)
 def get_tavily_client():
-    """Get Tavily client, initializing if needed."""
-    global _tavily_client
-    if _tavily_client is None:
-        api_key = os.getenv("TAVILY_API_KEY")
-        if not api_key:
-            raise ValueError("TAVILY_API_KEY environment variable not set")
-        _tavily_client = TavilyClient(api_key=api_key)
-    return _tavily_client
+    """Get Tavily client, initializing it on first use."""
+    from tavily import TavilyClient
+    
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        raise ValueError("TAVILY_API_KEY environment variable not set")
+    return TavilyClient(api_key=api_key)
 
 def search_web(query: str) -> str:
     """Search the web using Tavily API."""
     try:
         tavily = get_tavily_client()
         response = tavily.search(query=query, max_results=5)
-        results = []
-        for result in response.get('results', []):
-            results.append(f"**{result['title']}**\n{result['content']}\nURL: {result['url']}\n")
-        return "\n".join(results) if results else "No results found."
+        return "\n".join(
+            f"**{result['title']}**\n{result['content']}\nURL: {result['url']}\n"
+            for result in response.get('results', ())
+        ) or "No results found."
     except Exception as e:
         return f"Search error: {str(e)}"
 
+class ShellWorker:
+    """Long-lived shell that runs commands without a fork/exec of a new shell per call.
+
+    Each command runs in a subshell started from the caller's current
+    directory with stdin from /dev/null, so `cd`, `exit` and variable
+    assignments do not leak between calls. Its stdout and stderr go to
+    files private to that call, so output from background jobs never shows
+    up in later calls. The worker is restarted whenever os.environ has
+    changed since it was started, so commands see the live environment.
+    Completion is signalled by a per-worker marker on the worker's stdout.
+
+    A single worker runs one command at a time; callers that find it busy
+    get None back and should run the command some other way.
+    """
+
+    def __init__(self, shell: str = "/bin/sh"):
+        self.shell = shell
+        self._proc: Optional[subprocess.Popen] = None
+        self._env: Dict[str, str] = {}
+        self._tmpdir: Optional[str] = None
+        self._calls = 0
+        self._lock = threading.Lock()
+        self._marker = f"__END_{uuid.uuid4().hex}__".encode()
+
+    def _start(self, env: Dict[str, str]):
+        self._env = env
+        self._tmpdir = tempfile.mkdtemp(prefix="instant-agent-shell-")
+        self._proc = subprocess.Popen(
+            [self.shell],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+            start_new_session=True
+        )
+
+    def close(self):
+        """Terminate the shell and anything it is still running."""
+        if self._proc is not None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self._proc.wait()
+            self._proc = None
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def run(self, command: str, timeout: float = 30) -> Optional[Tuple[str, str, int]]:
+        """Run a command, returning (stdout, stderr, returncode).
+
+        Returns None if the worker is busy with another command or cannot be
+        started; the command has not been run in that case. Once the command
+        has been sent it is never reported as unrun: raises
+        subprocess.TimeoutExpired on timeout and RuntimeError if the worker
+        exits while running it.
+        """
+        if os.name != "posix":
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            try:
+                env = dict(os.environ)
+                if self._proc is None or self._proc.poll() is not None or env != self._env:
+                    self.close()
+                    self._start(env)
+                self._calls += 1
+                out_file = os.path.join(self._tmpdir, f"{self._calls}.out")
+                err_file = os.path.join(self._tmpdir, f"{self._calls}.err")
+                script = (
+                    f"( cd {shlex.quote(os.getcwd())} && eval {shlex.quote(command)} ) "
+                    f"</dev/null >{shlex.quote(out_file)} 2>{shlex.quote(err_file)}; "
+                    f"printf '%s%d\\n' {self._marker.decode()} $?\n"
+                )
+                self._proc.stdin.write(script.encode())
+            except OSError:
+                self.close()
+                return None
+            try:
+                returncode = self._wait_for_marker(command, timeout)
+                return _read_and_remove(out_file), _read_and_remove(err_file), returncode
+            except EOFError:
+                self.close()
+                # The command may have had side effects, so it is not retried
+                raise RuntimeError("shell worker exited while running the command")
+            except BaseException:
+                self.close()
+                raise
+        finally:
+            self._lock.release()
+
+    def _wait_for_marker(self, command: str, timeout: float) -> int:
+        """Wait for the end marker on the worker's stdout and return the exit code."""
+        stdout_fd = self._proc.stdout.fileno()
+        out = bytearray()
+        deadline = time.monotonic() + timeout
+        
+        with selectors.DefaultSelector() as selector:
+            selector.register(stdout_fd, selectors.EVENT_READ)
+            while True:
+                end = out.find(self._marker)
+                if end != -1 and out.find(b"\n", end) != -1:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                if selector.select(remaining):
+                    chunk = os.read(stdout_fd, 65536)
+                    if not chunk:
+                        raise EOFError("shell worker exited unexpectedly")
+                    out += chunk
+        
+        return int(out[end + len(self._marker):out.index(b"\n", end)])
+
+def _read_and_remove(path: str) -> str:
+    """Read a command's captured output file and delete it."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode(errors="replace")
+    except FileNotFoundError:
+        return ""
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+_shell_worker = ShellWorker()
+atexit.register(_shell_worker.close)
+
 def execute_shell(command: str) -> str:
     """Execute a shell command safely."""
     try:
         # Basic safety check - block dangerous commands
-        dangerous_commands = ['rm -rf', 'sudo', 'chmod 777', 'dd if=', 'mkfs', 'fdisk']
-        if any(dangerous in command.lower() for dangerous in dangerous_commands):
+        if _DANGEROUS_RE.search(command):
             return "Command blocked for safety reasons."
         
+        output = _shell_worker.run(command, timeout=30)
+        if output is not None:
+            return format_shell_output(*output)
+        
+        # Worker busy or unavailable - fall back to a one-off shell
         result = subprocess.run(
             command,
             shell=True,
@@ -48,15 +195,69 @@ def execute_shell(command: str) -> str:
             timeout=30
         )
         
-        output = ""
-        if result.stdout:
-            output += f"STDOUT:\n{result.stdout}\n"
-        if result.stderr:
-            output += f"STDERR:\n{result.stderr}\n"
-        output += f"Return code: {result.returncode}"
-        
+        return format_shell_output(result.stdout, result.stderr, result.returncode)
+    except subprocess.TimeoutExpired:
+        return "Command timed out after 30 seconds."
+    except Exception as e:
+        return f"Execution error: {str(e)}"
+
+class CommandBlockedError(PermissionError):
+    """Raised when a command fails the basic safety check."""
+
+async def run_shell_async(command: str, timeout: float = 30) -> Tuple[str, str, int]:
+    """Run a shell command without blocking the event loop.
+
+    Returns (stdout, stderr, returncode). Raises CommandBlockedError for
+    dangerous commands and subprocess.TimeoutExpired on timeout.
+    """
+    # Basic safety check - block dangerous commands
+    if _DANGEROUS_RE.search(command):
+        raise CommandBlockedError("Command blocked for safety reasons.")
+    
+    # Prefer the persistent worker; if it is busy with another command,
+    # run this one in a one-off shell so concurrent calls still overlap
+    output = await asyncio.to_thread(_shell_worker.run, command, timeout)
+    if output is not None:
         return output
+    
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        # Kill the whole process group; killing only the shell would leave
+        # its children holding the pipes open
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        await proc.wait()
+        raise subprocess.TimeoutExpired(command, timeout)
+    
+    return stdout.decode(errors="replace"), stderr.decode(errors="replace"), proc.returncode
+
+async def execute_shell_async(command: str) -> str:
+    """Execute a shell command safely without blocking the event loop."""
+    try:
+        return format_shell_output(*await run_shell_async(command, timeout=30))
+    except CommandBlockedError as e:
+        return str(e)
     except subprocess.TimeoutExpired:
         return "Command timed out after 30 seconds."
     except Exception as e:
         return f"Execution error: {str(e)}"
+
+def format_shell_output(stdout: str, stderr: str, returncode: int) -> str:
+    """Format captured command output for the agent."""
+    output = ""
+    if stdout:
+        output += f"STDOUT:\n{stdout}\n"
+    if stderr:
+        output += f"STDERR:\n{stderr}\n"
+    output += f"Return code: {returncode}"
+    
+    return output